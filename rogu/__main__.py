@@ -4,14 +4,20 @@ import sys
 #   - the walrus operator
 #   - mimetypes.guess_type path-like support
 #
+# New 3.9 features used:
+#   - functools.cache
+#
+# New 3.10 features used:
+#   - dataclass slots
+#
 # Arrow requires >= 3.6
 # Click requires >= 3.7
 # Jinja2 requires >= 3.7
 # PyYAML requires >= 3.6
 # Requests requires >= 3.7
 #
-if sys.version_info < (3, 8):
-    sys.exit("Python 3.8 or higher is required.")
+if sys.version_info < (3, 10):
+    sys.exit("Python 3.10 or higher is required.")
 
 # Add location of third party libraries to sys.path
 sys.path.insert(1, f'{sys.path[0]}/thirdparty')
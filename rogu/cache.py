@@ -6,7 +6,7 @@ import atexit
 import pickle
 import shelve
 from pathlib import Path
-from typing import Union
+from typing import Union, List
 
 import config
 
@@ -23,6 +23,9 @@ resources_file = Path(config.app_dir) / 'rogu-resource-cache'
 resources = _open(resources_file)
 atexit.register(resources.close)
 
+# Sorted keys of the resources cache, see resource_keys()
+_resource_keys = None
+
 _caches = {}
 
 
@@ -45,6 +48,24 @@ def get(name: Union[str, Path]) -> shelve.Shelf:
     return __getattr__(name)
 
 
+def resource_keys() -> List[str]:
+    """Return the keys of the resources cache, sorted.
+
+    The list is cached, and must be invalidated with
+    invalidate_resource_keys() whenever resources are added or removed.
+    """
+    global _resource_keys
+    if _resource_keys is None:
+        _resource_keys = sorted(resources)
+    return _resource_keys
+
+
+def invalidate_resource_keys():
+    """Invalidate the cached keys of the resources cache."""
+    global _resource_keys
+    _resource_keys = None
+
+
 def path(name: Union[str, Path]) -> Path:
     """Return the path to a cache file with the given name.
     Any missing parent directories will be created.
@@ -1,5 +1,4 @@
 import sys
-from functools import partial
 from typing import Iterable
 
 import click
@@ -550,10 +549,20 @@ def resource_key(path, uri, exists):
 # ------------------------------------------------------------------------------
 # UTILS
 
-dim = partial(style, dim=True)
-bold = partial(style, bold=True)
-red = partial(style, fg='red')
-green = partial(style, fg='green')
+def dim(text, **kwargs):
+    return style(text, dim=True, **kwargs)
+
+
+def bold(text, **kwargs):
+    return style(text, bold=True, **kwargs)
+
+
+def red(text, **kwargs):
+    return style(text, fg='red', **kwargs)
+
+
+def green(text, **kwargs):
+    return style(text, fg='green', **kwargs)
 
 
 def bail(*args, **kwargs):
@@ -569,10 +578,6 @@ def echo_ugor_file(file, exclude=None, include=None):
     Any attributes in the exclude list will be skipped.
     Attributes with None values will be skipped as well.
     """
-    from functools import partial
-
-    label = partial(style, bold=True)
-
     attributes = include if include else [
         'name',
         'content',
@@ -597,10 +602,10 @@ def echo_ugor_file(file, exclude=None, include=None):
             continue
         if (val := getattr(file, attr, None)) is not None:
             lbl = attr.replace('_', ' ').title().ljust(width)
-            echo(f"{label(lbl)} {val}")
+            echo(f"{bold(lbl)} {val}")
 
     if not (exclude and 'content' in exclude) and 'content' in attributes:
-        echo(f'\n{label("Content")}\n{file.content}')
+        echo(f'\n{bold("Content")}\n{file.content}')
 
 
 def echo_row(cols: Iterable[str], widths: Iterable[int], sep: str = '  '):
@@ -61,13 +61,13 @@ def refresh_resource(f):
 
 
 def fail(msg, cause=None, /):
-    if cause:
+    if cause is not None:
         raise AppError(msg) from cause
     raise AppError(msg)
 
 
 def blocked(msg, cause=None, /):
-    if cause:
+    if cause is not None:
         raise ActionBlocked(msg) from cause
     raise ActionBlocked(msg)
 
@@ -205,7 +205,6 @@ def upload(r, ignore_divergence: bool = False, ignore_conditionals: bool = False
     :param r: a ``Resource`` instance
     :param ignore_divergence: ignore divergence issues
     :param ignore_conditionals: ignore conditional request headers
-    :return: a ``Result`` instance
     """
     debug(f'Uploading {r!r}')
 
@@ -303,6 +302,7 @@ def move(r, path):
     r.path = Path(resources.normalize_path(path))
 
     del cache.resources[old_key]
+    cache.invalidate_resource_keys()
     store(r)
     verbose(f'{r} moved')
 
@@ -316,6 +316,7 @@ def delete(r):
     import cache
 
     del cache.resources[r]
+    cache.invalidate_resource_keys()
     verbose(f'{r} deleted')
 
 
@@ -331,6 +332,9 @@ def store(r):
     :param r: a ``Resource`` instance
     """
     import cache
+    # Most stores update an existing resource, which doesn't change the keys
+    if r.key not in cache.resources:
+        cache.invalidate_resource_keys()
     cache.resources[r] = r
 
 
@@ -368,5 +372,4 @@ def is_synced(r):
 @need_resource
 def is_ugor(resource):
     """Check if a resource is an Ugor resource."""
-    from urllib.parse import urlparse
-    return urlparse(resource.uri).scheme == 'ugor'
+    return resource.parsed_uri.scheme == 'ugor'
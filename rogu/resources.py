@@ -1,16 +1,22 @@
 """The resource objects - the core of Rogu"""
 
 import abc
+import bisect
 import shutil
 import hashlib
 import os
 import re
-from functools import cache
+import stat
+import zlib
+from functools import cache, lru_cache
+from operator import attrgetter
 from pathlib import Path
-from typing import Union, Optional
-from urllib.parse import urlparse
+from types import MappingProxyType
+from typing import Union, Optional, Dict, Iterable, List, Mapping, Tuple
+from urllib.parse import urlparse, ParseResult
 
 import arrow
+import requests
 import ugor
 from errors import *
 from ui import *
@@ -22,11 +28,19 @@ __all__ = [
     'Release',
 
     'cache_key',
+    'exists_many',
     'expand_key',
     'get',
+    'get_many',
     'normalize_path',
 ]
 
+# Home directory, used to shorten paths for display
+_HOME = str(Path.home())
+
+# Chunk size used when streaming downloads and decompressing files
+CHUNK_SIZE = 1 << 20
+
 
 class Resource(abc.ABC):
     """Resource is the base class for all resources, the core of Rogu.
@@ -61,7 +75,7 @@ class Resource(abc.ABC):
     :param path: the path to the resource.
     :param uri: the uri of the resource.
     """
-    path: Path
+    _path: Path
     uri: str
 
     # CATEGORIES
@@ -85,39 +99,108 @@ class Resource(abc.ABC):
 
     # The category of the resource are used to determine how Rogu should
     # handle the resource during automatic updates.
-    category: int = DEFAULT
+    category: int
+
+    __slots__ = ('_path', 'uri', 'category', '_parsed_uri', '_fp')
+
+    # Default attribute values, set on creation and when unpickling.
+    # Subclasses with more slots must extend this.
+    _defaults = {
+        'category': DEFAULT,
+        # The parsed uri, set on first use of ``parsed_uri``
+        '_parsed_uri': None,
+        # Fingerprint of path and uri, set on first comparison
+        '_fp': None,
+    }
 
-    # Mapping of resource names to classes
-    subclasses = {}
+    # Attributes derived from path and uri on first use. They are left out
+    # of the pickled state, so a stored resource never carries stale values.
+    _derived = frozenset(('_parsed_uri', '_fp'))
 
     def __init__(self, path: Union[Path, str], uri: str):
         if not uri:
             raise ValueError('Resource must have a uri.')
         if not path:
             raise ValueError('Resource must have a path.')
+        for name, value in self._defaults.items():
+            setattr(self, name, value)
         self.uri = uri
         self.path = Path(normalize_path(path))
 
-    def __init_subclass__(cls, **kwargs):
-        super().__init_subclass__(**kwargs)
-        cls.subclasses[cls.__name__] = cls
+    def __getstate__(self):
+        return {
+            name: getattr(self, name)
+            for cls in type(self).__mro__
+            for name in getattr(cls, '__slots__', ())
+            if name not in self._derived and hasattr(self, name)
+        }
+
+    def __setstate__(self, state):
+        # Resources pickled before slots were used have their __dict__
+        # as state, which may be missing attributes added since.
+        state = {**self._defaults, **state}
+        # Ignore derived values stored by earlier versions
+        state.update((name, self._defaults[name]) for name in self._derived)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def by_name(cls, name: str) -> type:
+        """Return the resource class with the given name.
+
+        :raises KeyError: if there is no resource class with that name.
+        """
+        return _REGISTRY[name]
 
     def __hash__(self):
         """Hash the resource. The hash is constant between runs."""
-        import zlib
         key = cache_key(path=self.path, uri=self.uri)
         return zlib.adler32(key.encode())
 
     def __eq__(self, other):
         if isinstance(other, Resource):
-            return self.path == other.path and self.uri == other.uri
+            # Most unequal resources are told apart by the fingerprint
+            # alone, without comparing paths.
+            return (
+                self.fingerprint == other.fingerprint
+                and self.path == other.path
+                and self.uri == other.uri
+            )
         return False
 
+    @property
+    def path(self) -> Path:
+        """The path to the resource."""
+        return self._path
+
+    @path.setter
+    def path(self, value: Path):
+        self._path = value
+        self._fp = None
+
+    @property
+    def fingerprint(self) -> int:
+        """Integer fingerprint of the path and uri.
+
+        It is taken from the SHA1 digest in the cache key, and is reset
+        whenever the path changes.
+        """
+        if self._fp is None:
+            self._fp = int(self.key[2:18], 16)
+        return self._fp
+
+    @property
+    def parsed_uri(self) -> ParseResult:
+        """The uri parsed with urlparse. Computed once, since the uri
+        never changes after creation."""
+        if self._parsed_uri is None:
+            self._parsed_uri = urlparse(self.uri)
+        return self._parsed_uri
+
     @property
     def short_path(self) -> str:
         """Path as a string with home converted to ~ """
-        home = str(Path.home())
-        return str(self.path).replace(home, '~')
+        return str(self.path).replace(_HOME, '~')
 
     @property
     def class_name(self) -> str:
@@ -148,13 +231,14 @@ class Resource(abc.ABC):
 
         This is used to determine if the resource has changed locally.
         """
-        if not self.path.exists():
+        st = _stat(self.path)
+        if st is None:
             return ''
 
         h = hashlib.sha1()
 
         # If the resource is a file, just hash the file
-        if self.path.is_file():
+        if stat.S_ISREG(st.st_mode):
             h.update(self.path.read_bytes())
             return h.hexdigest()
 
@@ -192,15 +276,17 @@ class Resource(abc.ABC):
         in the directory is returned.
         """
 
-        if not self.path.exists():
+        st = _stat(self.path)
+        if st is None:
             return arrow.get(0)
 
-        if self.path.is_file():
-            return arrow.get(self.path.stat().st_mtime)
+        if stat.S_ISREG(st.st_mode):
+            return arrow.get(st.st_mtime)
 
         # Respect the first .gitignore encountered
         gitignore = None
-        time = arrow.get(0)
+        # Compare integer timestamps, and only create an Arrow at the end
+        mtime_ns = 0
 
         # Find the last modified time of any file in the directory
         for root, dirs, files in os.walk(self.path):
@@ -218,9 +304,9 @@ class Resource(abc.ABC):
                 if gitignore and file in gitignore:
                     continue
                 p = root / file
-                time = max(time, arrow.get(p.stat().st_mtime))
+                mtime_ns = max(mtime_ns, p.stat().st_mtime_ns)
 
-        return time
+        return arrow.get(mtime_ns / 1e9)
 
     @property
     def key(self):
@@ -261,17 +347,18 @@ class Resource(abc.ABC):
         path = self.short_path
         return f'<{self.class_name} {path=!r} {uri=!r}>'
 
+    # Attribute getters for the supported format specs
+    _format_specs = {
+        'U': attrgetter('uri'),
+        'P': attrgetter('short_path'),
+        'K': attrgetter('short_key'),
+        'C': attrgetter('class_name'),
+        'H': attrgetter('path_hash'),
+    }
+
     def __format__(self, format_spec):
-        if format_spec == 'U':
-            return self.uri
-        if format_spec == 'P':
-            return self.short_path
-        if format_spec == 'K':
-            return self.short_key
-        if format_spec == 'C':
-            return self.class_name
-        if format_spec == 'H':
-            return self.path_hash
+        if getter := self._format_specs.get(format_spec):
+            return getter(self)
         return str(self)
 
 
@@ -284,34 +371,45 @@ class _UgorResource(Resource):
     All subclasses must make sure ``self.name`` is set to the name of the
     Ugor file.
     """
-    last_etag = None
-    last_modified = None
-    description = None
+    __slots__ = ('last_etag', 'last_modified', 'description')
 
-    def ugor_install(self, force: bool) -> Optional[bytes]:
-        """Download this resource from Ugor.
+    _defaults = {
+        **Resource._defaults,
+        'last_etag': None,
+        'last_modified': None,
+        'description': None,
+    }
+
+    def ugor_install(self, force: bool, dest: Path) -> bool:
+        """Download this resource from Ugor to dest.
 
         Handles etag and modified logic.
 
-        :returns: the file content or None if it's up-to-date.
+        :returns: True if downloaded, or False if it's up-to-date.
         """
         debug('..._UgorResource.ugor_install()')
 
-        file = ugor.get(
+        if force:
+            etag = modified = None
+        else:
+            etag, modified = self.last_etag, self.last_modified
+
+        file = ugor.get_to_file(
             name=self.name,
-            etag=self.last_etag if not force else None,
-            modified=self.last_modified if not force else None,
+            path=dest,
+            etag=etag,
+            modified=modified,
         )
 
         if file is None:
             verbose(f'{self} is up-to-date')
-            return None
+            return False
         if file.description:
             self.description = file.description
 
         self.last_etag = file.last_etag
         self.last_modified = file.last_modified
-        return file.content
+        return True
 
     def ugor_upload(self, obj: Union[Path, bytes, str], force: bool):
         """Upload this resource to Ugor."""
@@ -321,12 +419,10 @@ class _UgorResource(Resource):
             obj=obj,
             name=self.name,
             force=force,
-            **{
-                'last_etag': self.last_etag,
-                'last_modified': self.last_modified,
-                'description': self.description,
-                'tag2': 'Rogu',
-            }
+            last_etag=self.last_etag,
+            last_modified=self.last_modified,
+            description=self.description,
+            tag2='Rogu',
         )
         self.last_etag = file.last_etag
         self.last_modified = file.last_modified
@@ -400,12 +496,11 @@ class Archive(_UgorResource):
     Manages reading and writing of archives, with compression, and other
     File functionality.
     """
+    __slots__ = ('format',)
 
-    format = 'xztar'
-
-    extensions = {
-        fmt: ext[0]
-        for fmt, ext, _ in shutil.get_unpack_formats()
+    _defaults = {
+        **_UgorResource._defaults,
+        'format': 'xztar',
     }
 
     def __init__(
@@ -418,21 +513,20 @@ class Archive(_UgorResource):
         super().__init__(path, uri)
         self.description = description
 
-        parsed = urlparse(uri)
-        if m := re.search(r'format=(\w+)', parsed.query):
+        if m := re.search(r'format=(\w+)', self.parsed_uri.query):
             self.format = m.group(1)
-        if self.format not in self.extensions:
+        if self.format not in archive_extensions():
             raise ValueError(f'Invalid archive format: {self.format}')
 
     @property
     def name(self):
         """Archive name with extension. This is the Ugor name."""
-        return self.base_name + self.extensions[self.format]
+        return self.base_name + archive_extensions()[self.format]
 
     @property
     def base_name(self):
         """Archive name without archive extension."""
-        return urlparse(self.uri).path.lstrip('/')
+        return self.parsed_uri.path.lstrip('/')
 
     # RESOURCE ACTIONS
 
@@ -452,15 +546,15 @@ class Archive(_UgorResource):
         import cache
         debug('...Archive.install()')
 
-        content = self.ugor_install(force)
-        if content is None:
-            return
-
         ftmp = cache.path(self.name)
-        ftmp.write_bytes(content)
-
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.unpack_archive(ftmp, self.path)
+        try:
+            if not self.ugor_install(force, ftmp):
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.unpack_archive(ftmp, self.path)
+        finally:
+            # The download is only a staging copy, don't keep it around
+            ftmp.unlink(missing_ok=True)
 
         # Would ideally do this in _UgorResource.ugor_install() but
         # we need to unpack the archive first.
@@ -491,6 +585,7 @@ class File(_UgorResource):
 
     The file path must be a file.
     """
+    __slots__ = ()
 
     def __init__(
             self,
@@ -505,7 +600,7 @@ class File(_UgorResource):
     @property
     def name(self):
         """The Ugor file name."""
-        return urlparse(self.uri).path.lstrip('/')
+        return self.parsed_uri.path.lstrip('/')
 
     def refresh_metadata(self):
         """Refresh the metadata of the file."""
@@ -520,18 +615,24 @@ class File(_UgorResource):
 
     def install(self, force: bool = False):
         """Install the file to its path from the uri."""
+        import cache
         debug('...File.install()')
-        content = self.ugor_install(force)
-        if content is None:
-            return
-
-        if not self.path.parent.exists():
-            self.path.parent.mkdir(parents=True)
-        if self.path.exists():
-            backup = self.path.parent / f'.{self.path.name}~'
-            shutil.copy(self.path, backup)
-            debug(f'Backed up to {backup.name}')
-        self.path.write_bytes(content)
+
+        # Download to the cache first, to not leave a partial file
+        # behind if the download fails.
+        ftmp = cache.path(self.name)
+        try:
+            if not self.ugor_install(force, ftmp):
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists():
+                backup = self.path.parent / f'.{self.path.name}~'
+                shutil.copy(self.path, backup)
+                debug(f'Backed up to {backup.name}')
+            shutil.copyfile(ftmp, self.path)
+        finally:
+            # The download is only a staging copy, don't keep it around
+            ftmp.unlink(missing_ok=True)
 
         # Would ideally do this in _UgorResource.ugor_install() but
         # we need to write the file first.
@@ -555,8 +656,12 @@ class File(_UgorResource):
 
 class Release(Resource):
     """A GitHub Release object for RDSL."""
+    __slots__ = ('last_etag',)
 
-    last_etag = None
+    _defaults = {
+        **Resource._defaults,
+        'last_etag': None,
+    }
 
     def __init__(self, path, uri):
         debug(f'Creating Release of {path=!r} {uri=!r}')
@@ -565,7 +670,7 @@ class Release(Resource):
     @property
     def github_url(self):
         """The GitHub URL of the release."""
-        parsed = urlparse(self.uri)
+        parsed = self.parsed_uri
         repo, user = parsed.netloc.split('@')
         file = parsed.path.lstrip('/')
         return f'https://github.com/{user}/{repo}/releases/latest/download/{file}'
@@ -580,7 +685,6 @@ class Release(Resource):
                 the local file is older.
         """
         # Check if the release has changed
-        import requests
         debug(f'...Release.divergence()')
 
         # A release can only ever be installed, and are not expected to be
@@ -589,7 +693,7 @@ class Release(Resource):
         if not self.path.exists() or not self.last_etag:
             return -1
 
-        r = requests.head(self.github_url, allow_redirects=True)
+        r = _session().head(self.github_url, allow_redirects=True)
         etag = r.headers.get('ETag')
 
         # If the ETag isn't available we must always assume the release
@@ -606,30 +710,30 @@ class Release(Resource):
         If it has gz, bz2, or xz extension it will be decompressed.
         """
         import cache
-        import requests
         debug(f'...Release.install()')
 
         url = self.github_url
         file = urlparse(url).path.lstrip('/')
 
-        if self.path.exists():
-            mode = self.path.stat().st_mode
-        else:
-            mode = None
+        st = _stat(self.path)
+        mode = st.st_mode if st else None
         debug(f'File {mode=!r}')
 
-        # Download the release
-        r = requests.get(url, allow_redirects=True)
-        try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            raise ActionBlocked(e)
-        self.last_etag = r.headers.get('ETag')
+        # Download the release, streaming it to disk to avoid holding
+        # the entire file in memory.
+        ftmp = cache.path(file)
+        with _session().get(url, allow_redirects=True, stream=True) as r:
+            try:
+                r.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                raise ActionBlocked(e)
+            self.last_etag = r.headers.get('ETag')
+
+            with ftmp.open('wb') as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
 
         # Unpack/Decompress and install the release
-        ftmp = cache.path(file)
-        with ftmp.open('wb') as f:
-            f.write(r.content)
 
         shutil.register_unpack_format('gzip', ['.gz'], unpack_gzip)
         shutil.register_unpack_format('bzip2', ['.bz2'], unpack_bzip2)
@@ -649,6 +753,14 @@ class Release(Resource):
             shutil.unregister_unpack_format('xz')
 
 
+# Mapping of resource names to classes
+_REGISTRY = {
+    'Archive': Archive,
+    'File': File,
+    'Release': Release,
+}
+
+
 # ------------------------------------------------------------------------------
 # CACHE INTERFACE
 
@@ -686,13 +798,17 @@ def expand_key(key: str) -> str:
 
     Unless exactly one match is found, it raises ValueError.
     """
-    from cache import resources
-    matches = [k for k in resources if k.startswith(key)]
-    if len(matches) > 1:
-        raise ValueError(f'Key {key} is ambiguous.')
-    elif len(matches) == 0:
+    from cache import resource_keys
+    keys = resource_keys()
+
+    # All keys starting with key are adjacent in the sorted list, so only
+    # the first match and the one after it needs to be checked.
+    i = bisect.bisect_left(keys, key)
+    if i == len(keys) or not keys[i].startswith(key):
         raise ValueError(f'Key {key} does not match any resources.')
-    return matches.pop()
+    if i + 1 < len(keys) and keys[i + 1].startswith(key):
+        raise ValueError(f'Key {key} is ambiguous.')
+    return keys[i]
 
 
 def get(path: Union[Path, str], uri: str) -> Resource:
@@ -709,16 +825,101 @@ def get(path: Union[Path, str], uri: str) -> Resource:
     raise ResourceNotFound(path, uri)
 
 
+def get_many(pairs: Iterable[Tuple[Union[Path, str], str]]) -> Dict[str, Resource]:
+    """Get several resources from the cache.
+
+    pairs is an iterable of (path, uri) tuples.
+
+    Returns a dict mapping cache keys to resources. Resources which are
+    not found are left out.
+    """
+    from cache import resources
+
+    keys = [cache_key(path=path, uri=uri) for path, uri in pairs]
+    return {
+        key: r
+        for key in keys
+        if (r := resources.get(key)) is not None
+    }
+
+
+def exists_many(pairs: Iterable[Tuple[Union[Path, str], str]]) -> List[bool]:
+    """Check if several resources exist in the cache.
+
+    pairs is an iterable of (path, uri) tuples.
+
+    Returns a list of booleans, in the same order as pairs.
+    """
+    from cache import resources
+
+    keys = [cache_key(path=path, uri=uri) for path, uri in pairs]
+    return [key in resources for key in keys]
+
+
 # ------------------------------------------------------------------------------
 # UTILS
 
+def _stat(path: Path) -> Optional[os.stat_result]:
+    """Stat a path, returning None if it doesn't exist.
+
+    This replaces separate exists() and is_file()/is_dir() checks,
+    which each stat the path.
+    """
+    try:
+        return path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+_SESSION = None
+
+
+def _session() -> requests.Session:
+    """Return the HTTP session shared by all resources.
+
+    Reusing the session keeps connections alive between requests,
+    so several resources on the same host only connect once.
+    """
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10)
+        _SESSION.mount('http://', adapter)
+        _SESSION.mount('https://', adapter)
+    return _SESSION
+
+
 def normalize_path(path: Union[Path, str]) -> str:
     """Normalize a path.
 
     Returns a canonical path with expanded user and environment variables.
     """
-    from os.path import expanduser, expandvars, realpath
-    return realpath(expanduser(expandvars(path)))
+    path = os.fspath(path)
+    # Expanded paths depend on the environment, and relative paths on the
+    # work directory (which rdsl.chdir changes), so neither can be cached.
+    if '~' in path or '$' in path:
+        return os.path.realpath(os.path.expanduser(os.path.expandvars(path)))
+    if not os.path.isabs(path):
+        return os.path.realpath(path)
+    return _realpath(path)
+
+
+# realpath stats every component of the path, so cache it for absolute paths
+_realpath = lru_cache(maxsize=4096)(os.path.realpath)
+
+
+@cache
+def archive_extensions() -> Mapping[str, str]:
+    """Read-only mapping of the supported archive formats to their
+    file extension.
+
+    This is computed on first use, rather than at import, since most runs
+    never deal with archives.
+    """
+    return MappingProxyType({
+        fmt: exts[0]
+        for fmt, exts, _ in shutil.get_unpack_formats()
+    })
 
 
 class Gitignore:
@@ -740,22 +941,22 @@ class Gitignore:
 def unpack_gzip(path, dest):
     """Unpack a gzip file to a destination."""
     import gzip
-    with gzip.open(path, 'rb') as f:
-        Path(dest).write_bytes(f.read())
+    with gzip.open(path, 'rb') as f, open(dest, 'wb') as out:
+        shutil.copyfileobj(f, out, CHUNK_SIZE)
 
 
 def unpack_bzip2(path, dest):
     """Unpack a bzip2 file to a destination."""
     import bz2
-    with bz2.open(path, 'rb') as f:
-        Path(dest).write_bytes(f.read())
+    with bz2.open(path, 'rb') as f, open(dest, 'wb') as out:
+        shutil.copyfileobj(f, out, CHUNK_SIZE)
 
 
 def unpack_xz(path, dest):
     """Unpack a xz file to a destination."""
     import lzma
-    with lzma.open(path, 'rb') as f:
-        Path(dest).write_bytes(f.read())
+    with lzma.open(path, 'rb') as f, open(dest, 'wb') as out:
+        shutil.copyfileobj(f, out, CHUNK_SIZE)
 
 
 @cache
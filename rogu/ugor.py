@@ -1,36 +1,76 @@
 """Handles the communication with the Ugor server"""
 
+import mimetypes
+import threading
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from functools import wraps
-from pathlib import Path
-from typing import Optional, Any, Union, List, Dict, Tuple
+from functools import lru_cache, singledispatch
+from pathlib import Path, PurePath
+from typing import Optional, Any, Callable, Union, List, Dict, Tuple, Iterable
+from urllib.parse import urljoin
 
 import click
 import requests
-from errors import AppError, UgorError
+import ui
+from errors import AppError, UgorError, UgorError404
+from requests.adapters import HTTPAdapter
 from ui import *
-
-__all__ = ['auth', 'get', 'put', 'delete', 'find', 'info', 'UgorFile']
-
-
-def _ugor_error(f):
-    """Decorator that converts HTTPError's into Ugor errors"""
-
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        try:
-            return f(*args, **kwargs)
-        except requests.HTTPError as e:
-            raise UgorError(e.response, str(e)) from e
-
-    return wrapper
+from urllib3.util.retry import Retry
+
+__all__ = [
+    'auth', 'get', 'put', 'delete', 'find', 'info', 'UgorFile',
+    'get_to_file', 'get_many', 'put_many', 'exists_many',
+]
+
+# Number of concurrent requests used by the batch functions
+WORKERS = 16
+
+# Chunk size used when streaming downloads
+CHUNK_SIZE = 1 << 16
+
+# Session shared by all requests to the Ugor server, so connections
+# are kept alive and reused between requests.
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        # Only retry safe requests. A PUT or DELETE may already have been
+        # applied when the gateway fails, and its conditional headers
+        # would make the retry fail with 412.
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        # Return the last response, to be handled by raise_for_status()
+        raise_on_status=False,
+    ),
+)
+_session.mount('http://', _adapter)
+_session.mount('https://', _adapter)
+
+
+def _request(method: str, url: str, **kwargs) -> requests.Response:
+    """Send an authenticated request to the Ugor server.
+
+    All requests to Ugor go through this, converting HTTPError's
+    into Ugor errors.
+
+    :raises UgorError: if the response has an error status code.
+    """
+    r = _session.request(method, url, auth=auth(), **kwargs)
+    try:
+        r.raise_for_status()
+    except requests.HTTPError as e:
+        r.close()
+        raise UgorError(e.response, str(e)) from e
+    return r
 
 
 # -----------------------------------------------------------------------------
 # Primary functions
 
-@_ugor_error
 def get(
         name: str,
         etag: str = None,
@@ -45,24 +85,49 @@ def get(
     :raises UgorError404: if the file doesn't exist.
     :return: a UgorFile object or None if the file is not modified.
     """
-    headers = {}
-    if etag:
-        headers['If-None-Match'] = etag
-    if modified:
-        if hasattr(modified, 'isoformat'):
-            modified = modified.isoformat()
-        headers['If-Modified-Since'] = modified
+    headers = _get_headers(etag, modified)
 
     url = _url(name)
-    debug(f'GET {url!r}', *[f"{k}: {v!r}" for k, v in headers.items()])
+    if ui.DEBUG:
+        debug(f'GET {url!r}', *[f"{k}: {v!r}" for k, v in headers.items()])
 
-    r = requests.get(url, auth=auth(), headers=headers)
-    r.raise_for_status()
+    r = _request('GET', url, headers=headers)
     if r.status_code == 304:
         return None
     return UgorFile.of_response(name, r)
 
 
+def get_to_file(
+        name: str,
+        path: Union[Path, str],
+        etag: str = None,
+        modified: str = None
+) -> Optional['UgorFile']:
+    """Get a file from the Ugor server, streaming the content to path.
+
+    This works like get(), but the content is written to path in chunks
+    instead of being held in memory, which should be used for large files.
+
+    :raises UgorError404: if the file doesn't exist.
+    :return: a UgorFile object with path set and no content, or None if
+        the file is not modified.
+    """
+    headers = _get_headers(etag, modified)
+
+    url = _url(name)
+    if ui.DEBUG:
+        debug(f'GET {url!r}', *[f"{k}: {v!r}" for k, v in headers.items()])
+
+    with _request('GET', url, headers=headers, stream=True) as r:
+        if r.status_code == 304:
+            return None
+        file = UgorFile.of_response(name, r, path=Path(path))
+        with file.path.open('wb') as f:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+    return file
+
+
 FileHeader = namedtuple('FileHeader', [
     'name',
     'content_type',
@@ -80,8 +145,22 @@ FileHeader = namedtuple('FileHeader', [
     'data5',
 ])
 
+# Headers read into a FileHeader, in field order. The required headers
+# are always set by Ugor, while the optional are metadata headers.
+_REQ_HEADER_FIELDS = ('Content-Type', 'Content-Length', 'Last-Modified', 'ETag')
+_OPT_HEADER_FIELDS = (
+    'File-Description',
+    'File-Tag',
+    'File-Tag2',
+    'File-Tag3',
+    'File-Data',
+    'File-Data2',
+    'File-Data3',
+    'File-Data4',
+    'File-Data5',
+)
+
 
-@_ugor_error
 def get_header(name: str) -> FileHeader:
     """Get the header of a file on the Ugor server.
 
@@ -89,27 +168,19 @@ def get_header(name: str) -> FileHeader:
     """
     url = _url(name)
     debug('HEAD', url)
-    r = requests.head(url, auth=auth())
-    r.raise_for_status()
+    r = _request('HEAD', url)
+    h = r.headers
+    content_type, length, modified, etag = [h[k] for k in _REQ_HEADER_FIELDS]
     return FileHeader(
-        name=name,
-        content_type=r.headers['Content-Type'],
-        content_length=int(r.headers['Content-Length']),
-        modified=r.headers['Last-Modified'],
-        etag=r.headers['ETag'],
-        description=r.headers.get('File-Description'),
-        tag=r.headers.get('File-Tag'),
-        tag2=r.headers.get('File-Tag2'),
-        tag3=r.headers.get('File-Tag3'),
-        data=r.headers.get('File-Data'),
-        data2=r.headers.get('File-Data2'),
-        data3=r.headers.get('File-Data3'),
-        data4=r.headers.get('File-Data4'),
-        data5=r.headers.get('File-Data5'),
+        name,
+        content_type,
+        int(length),
+        modified,
+        etag,
+        *[h.get(k) for k in _OPT_HEADER_FIELDS],
     )
 
 
-@_ugor_error
 def put(
         obj: Union[Path, str, bytes],
         name: str,
@@ -134,28 +205,25 @@ def put(
     :raises FileNotFoundError: if obj is a file path that doesn't exist.
     :return: the uploaded UgorFile with new ETag and Last-Modified values.
     """
-    from pathlib import Path
-
-    # Create Ugor file object
-    if isinstance(obj, Path):
-        debug(f'Ugor put file: from path {obj!r}')
-        file = UgorFile.of_file(name or obj.name, obj, **metadata)
-    elif isinstance(obj, (str, bytes)):
-        debug(f'Ugor put file: with str/bytes content, named {name!r}')
-        file = UgorFile.of(name, obj, **metadata)
-    else:
-        raise TypeError(f'obj must be a Path, str or bytes, not {type(obj)}')
+    file = _file_of(obj, name, metadata)
 
-    headers = file.headers()
-    if file.last_etag and not force:
-        headers['If-Match'] = file.last_etag
-    if file.last_modified and not force:
-        headers['If-Unmodified-Since'] = file.last_modified
+    headers = {}
+    if not force:
+        if file.last_etag:
+            headers['If-Match'] = file.last_etag
+        if file.last_modified:
+            headers['If-Unmodified-Since'] = file.last_modified
+    headers.update(file.headers())
 
     url = _url(file.name)
-    debug('PUT', url, *[f"{k}: {v!r}" for k, v in headers.items()])
-    r = requests.put(url, auth=auth(), headers=headers, data=file.content)
-    r.raise_for_status()
+    if ui.DEBUG:
+        debug('PUT', url, *[f"{k}: {v!r}" for k, v in headers.items()])
+    if file.path:
+        # Stream the file from disk. Content-Length is set from its size.
+        with file.path.open('rb') as f:
+            r = _request('PUT', url, headers=headers, data=f)
+    else:
+        r = _request('PUT', url, headers=headers, data=file.content)
 
     try:
         file.last_etag = r.headers['ETag']
@@ -170,7 +238,6 @@ def put(
     return file
 
 
-@_ugor_error
 def delete(
         name: str,
         force: bool = False,
@@ -182,55 +249,154 @@ def delete(
     if etag and not force:
         headers['If-Match'] = etag
     if modified and not force:
-        if hasattr(modified, 'isoformat'):
+        if not isinstance(modified, str):
             modified = modified.isoformat()
         headers['If-Unmodified-Since'] = modified
 
     url = _url(name)
-    debug('DELETE', url, *[f"{k}: {v!r}" for k, v in headers.items()])
-    r = requests.delete(url, auth=auth(), headers=headers)
-    r.raise_for_status()
+    if ui.DEBUG:
+        debug('DELETE', url, *[f"{k}: {v!r}" for k, v in headers.items()])
+    _request('DELETE', url, headers=headers)
 
 
-@_ugor_error
 def find(**params) -> List[str]:
     """Find files on the Ugor server with the given search parameters"""
     from config import ugor_url
 
     params = {k: v for k, v in params.items() if v is not None}
     debug('FIND', ugor_url, params)
-    r = requests.request('FIND', ugor_url, auth=auth(), json=params)
-    r.raise_for_status()
+    r = _request('FIND', ugor_url, json=params)
     return r.json()
 
 
-@_ugor_error
 def info() -> Dict[str, Any]:
     """Get information about the Ugor server"""
     from config import ugor_url
 
     debug('INFO', ugor_url)
-    r = requests.request('INFO', ugor_url, auth=auth())
-    r.raise_for_status()
+    r = _request('INFO', ugor_url)
     return r.json()
 
 
-@_ugor_error
 def exists(name: str) -> bool:
     """Check if a file exists on the Ugor server"""
     url = _url(name)
     debug('HEAD', url)
-    r = requests.head(url, auth=auth())
-    if r.status_code == 404:
+    try:
+        _request('HEAD', url)
+    except UgorError404:
         return False
-    r.raise_for_status()
     return True
 
 
+# -----------------------------------------------------------------------------
+# Batch functions
+#
+# These run the primary functions concurrently in a thread pool, which
+# overlaps the network latency of each request.
+
+def get_many(
+        names: Iterable[str],
+        workers: int = WORKERS
+) -> Dict[str, Optional['UgorFile']]:
+    """Get several files from the Ugor server concurrently.
+
+    :return: a dict mapping names to UgorFile objects, or None for
+        files which don't exist.
+    """
+
+    def get_or_none(name):
+        try:
+            return get(name)
+        except UgorError404:
+            return None
+
+    names = list(names)
+    auth()  # Prompt for any missing credentials before starting threads
+    with ThreadPoolExecutor(workers) as ex:
+        return dict(zip(names, ex.map(get_or_none, names)))
+
+
+def put_many(
+        items: Iterable[Tuple[Union[Path, str, bytes], str]],
+        force: bool = False,
+        workers: int = WORKERS,
+        **metadata
+) -> List['UgorFile']:
+    """Upload several things to the Ugor server concurrently.
+
+    items is an iterable of (obj, name) tuples, as given to put().
+    The force and metadata arguments are used for every upload.
+
+    :return: the uploaded UgorFile objects, in the same order as items.
+    """
+
+    def put_item(item):
+        obj, name = item
+        return put(obj, name, force, **metadata)
+
+    auth()  # Prompt for any missing credentials before starting threads
+    with ThreadPoolExecutor(workers) as ex:
+        return list(ex.map(put_item, items))
+
+
+def exists_many(names: Iterable[str], workers: int = WORKERS) -> Dict[str, bool]:
+    """Check if several files exist on the Ugor server concurrently.
+
+    :return: a dict mapping names to whether the file exists.
+    """
+    names = list(names)
+    auth()  # Prompt for any missing credentials before starting threads
+    with ThreadPoolExecutor(workers) as ex:
+        return dict(zip(names, ex.map(exists, names)))
+
+
 # -----------------------------------------------------------------------------
 # UgorFile
 
-@dataclass
+# Mapping of Ugor headers to the UgorFile attributes they are set from
+_HEADER_MAP = (
+    ('Content-Type', 'mime_type'),
+    ('Content-Encoding', 'encoding'),
+    ('File-Description', 'description'),
+    ('File-Tag', 'tag'),
+    ('File-Tag2', 'tag2'),
+    ('File-Tag3', 'tag3'),
+    ('File-Data', 'data'),
+    ('File-Data2', 'data2'),
+    ('File-Data3', 'data3'),
+    ('File-Data4', 'data4'),
+    ('File-Data5', 'data5'),
+)
+
+
+def _compile_headers(header_map) -> Callable[['UgorFile'], Dict[str, str]]:
+    """Generate the UgorFile.headers() method from the header map.
+
+    The generated method has one check per header written out, instead of
+    looping over the header map on every call.
+    """
+    lines = ['def headers(self):', '    d = {}']
+    for header, attr in header_map:
+        lines.append(f'    if v := self.{attr}:')
+        lines.append(f'        d[{header!r}] = v')
+    lines.append('    return d')
+
+    ns = {}
+    code = compile('\n'.join(lines), f'<{__name__} generated headers>', 'exec')
+    exec(code, ns)
+    headers = ns['headers']
+    headers.__module__ = __name__
+    headers.__qualname__ = 'UgorFile.headers'
+    headers.__doc__ = """Return a dict with the metadata headers, as well as Content-Type
+        and Content-Encoding. The headers are only included if they are set.
+
+        The etag and modified headers must be set separately.
+        """
+    return headers
+
+
+@dataclass(slots=True)
 class UgorFile:
     """A file retrieved from the Ugor server"""
 
@@ -254,26 +420,29 @@ class UgorFile:
     data4: str = None
     data5: str = None
 
+    # Local file to stream the content from, instead of holding
+    # it in memory. Set by of_file().
+    path: Path = None
+
     def __post_init__(self):
         """Do some post-initialization work, normalizing data,
         guessing mime type and encoding, etc.
         """
-        import mimetypes
-
         assert self.name and isinstance(self.name, str), \
             'name must be given and be a string'
-        assert self.content and isinstance(self.content, bytes), \
-            'content must be given and be bytes'
+        assert self.path or (self.content and isinstance(self.content, bytes)), \
+            'content must be given and be bytes, unless path is given'
 
         # Guess mime type and encoding
         if not (self.mime_type and self.encoding):
-            mime_type, encoding = mimetypes.guess_type(self.name)
+            mime_type, encoding = _guess_type(self.name)
             self.mime_type = self.mime_type or mime_type
             self.encoding = self.encoding or encoding
 
         # Convert datetime/Arrow objects to ISO strings
-        if self.last_modified and hasattr(self.last_modified, 'isoformat'):
-            self.last_modified = self.last_modified.isoformat()
+        lm = self.last_modified
+        if lm and not isinstance(lm, str) and hasattr(lm, 'isoformat'):
+            self.last_modified = lm.isoformat()
 
     @classmethod
     def of(cls, name: str, content: Union[str, bytes], **metadata) -> 'UgorFile':
@@ -285,19 +454,28 @@ class UgorFile:
         return cls(name=name, content=content, **metadata)
 
     @classmethod
-    def of_response(cls, name: str, response: requests.Response) -> 'UgorFile':
+    def of_response(
+            cls,
+            name: str,
+            response: requests.Response,
+            path: Path = None
+    ) -> 'UgorFile':
         """Create a UgorFile from a response.
 
         This is based on the response of a GET request to Ugor, which is
         expected to always contain the ETag, Last-Modified and Content-Type
         headers.
 
+        If path is given the content is not read from the response, since
+        it is streamed to path by the caller.
+
         Raises AppError if the response is missing a required header.
         """
         try:
             return cls(
                 name=name,
-                content=response.content,
+                content=None if path else response.content,
+                path=path,
                 last_etag=response.headers['ETag'],
                 last_modified=response.headers['Last-Modified'],
                 mime_type=response.headers['Content-Type'],
@@ -317,46 +495,38 @@ class UgorFile:
 
     @classmethod
     def of_file(cls, name: str, path: Union[Path, str], **metadata) -> 'UgorFile':
-        """Create an UgorFile with the content read from path.
+        """Create an UgorFile with the content streamed from path.
+
+        The file is not read until it is uploaded by put().
 
         Raises FileNotFoundError if the file is not found.
         """
-        import mimetypes
+        path = Path(path)
+        if not path.is_file():
+            raise FileNotFoundError(f'No such file: {path}')
 
-        mime_type, encoding = mimetypes.guess_type(path)
+        mime_type, encoding = _guess_type(path)
         if mime_type:
             metadata.setdefault('mime_type', mime_type)
         if encoding:
             metadata.setdefault('encoding', encoding)
 
-        content = open(path, 'rb').read()
-        return cls.of(name, content, **metadata)
+        return cls(name=name, content=None, path=path, **metadata)
 
-    def headers(self) -> Dict[str, str]:
-        """Return a dict with the metadata headers, as well as Content-Type
-        and Content-Encoding. The headers are only included if they are set.
-
-        The etag and modified headers must be set separately.
-        """
-        items = (
-            ('Content-Type', self.mime_type),
-            ('Content-Encoding', self.encoding),
-            ('File-Description', self.description),
-            ('File-Tag', self.tag),
-            ('File-Tag2', self.tag2),
-            ('File-Tag3', self.tag3),
-            ('File-Data', self.data),
-            ('File-Data2', self.data2),
-            ('File-Data3', self.data3),
-            ('File-Data4', self.data4),
-            ('File-Data5', self.data5),
-        )
-        return {k: v for k, v in items if v}
+    # Generated from _HEADER_MAP, see _compile_headers()
+    headers = _compile_headers(_HEADER_MAP)
 
 
 # ------------------------------------------------------------------------------
 # Utility functions
 
+# The credentials cache isn't thread-safe, and is used by the batch functions
+_auth_lock = threading.Lock()
+
+# The credentials returned by auth(), read from the cache on first use
+_auth = None
+
+
 def auth(user: str = None, pwd: str = None) -> Tuple[str, str]:
     """Manage the Ugor authentication credentials.
 
@@ -364,23 +534,80 @@ def auth(user: str = None, pwd: str = None) -> Tuple[str, str]:
     If user and/or pwd are given, it sets the credentials.
     If user/pwd are None and doesn't exist in the cache, it will prompt the user.
     """
+    global _auth
+    if _auth is not None and not (user or pwd):
+        return _auth
+
     import cache
 
-    if user:
-        cache.primary['ugor_user'] = user
-    if pwd:
-        cache.primary['ugor_pwd'] = pwd
+    with _auth_lock:
+        if user:
+            cache.primary['ugor_user'] = user
+        if pwd:
+            cache.primary['ugor_pwd'] = pwd
+
+        if 'ugor_user' not in cache.primary:
+            cache.primary['ugor_user'] = click.prompt('Ugor user', type=str)
+        if 'ugor_pwd' not in cache.primary:
+            cache.primary['ugor_pwd'] = click.prompt('Ugor pwd', type=str, hide_input=True)
+
+        _auth = cache.primary['ugor_user'], cache.primary['ugor_pwd']
+        return _auth
+
+
+@singledispatch
+def _file_of(obj, name: str, metadata: dict) -> UgorFile:
+    """Create the UgorFile to upload with put(), dispatching on the
+    type of obj."""
+    raise TypeError(f'obj must be a Path, str or bytes, not {type(obj)}')
+
 
-    if 'ugor_user' not in cache.primary:
-        cache.primary['ugor_user'] = click.prompt('Ugor user', type=str)
-    if 'ugor_pwd' not in cache.primary:
-        cache.primary['ugor_pwd'] = click.prompt('Ugor pwd', type=str, hide_input=True)
+@_file_of.register
+def _(obj: Path, name: str, metadata: dict) -> UgorFile:
+    debug(f'Ugor put file: from path {obj!r}')
+    return UgorFile.of_file(name or obj.name, obj, **metadata)
 
-    return cache.primary['ugor_user'], cache.primary['ugor_pwd']
+
+@_file_of.register(str)
+@_file_of.register(bytes)
+def _(obj, name: str, metadata: dict) -> UgorFile:
+    debug(f'Ugor put file: with str/bytes content, named {name!r}')
+    return UgorFile.of(name, obj, **metadata)
+
+
+def _get_headers(etag: Optional[str], modified) -> Dict[str, str]:
+    """Return the conditional headers for a GET request."""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        if not isinstance(modified, str):
+            modified = modified.isoformat()
+        headers['If-Modified-Since'] = modified
+    return headers
+
+
+def _guess_type(name: Union[PurePath, str]) -> Tuple[Optional[str], Optional[str]]:
+    """Guess the mime type and encoding of a file name,
+    like mimetypes.guess_type().
+
+    The guess only depends on the last two extensions (e.g. '.tar.gz'),
+    so results are cached by those.
+    """
+    return _guess_type_of_suffix(''.join(PurePath(name).suffixes[-2:]))
+
+
+@lru_cache(maxsize=256)
+def _guess_type_of_suffix(suffix: str) -> Tuple[Optional[str], Optional[str]]:
+    return mimetypes.guess_type(f'file{suffix}')
 
 
 def _url(name: str) -> str:
     """Get the URL for the given file name"""
-    from urllib.parse import urljoin
     from config import ugor_url
-    return urljoin(ugor_url, name)
+    return _urljoin(ugor_url, name)
+
+
+# The base URL is part of the cache key, so changing
+# the Ugor URL never returns stale results.
+_urljoin = lru_cache(maxsize=1024)(urljoin)
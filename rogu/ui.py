@@ -1,53 +1,145 @@
-from click import echo, secho
+import sys
 
 
-__all__ = ['err', 'warn', 'good', 'bad', 'debug', 'verbose']
+__all__ = ['err', 'warn', 'good', 'bad', 'debug', 'debug_lazy', 'verbose']
 
 
 VERBOSE = False
 
+# Debug output is on unless running with -O. Check this before building
+# expensive debug messages.
+DEBUG = __debug__
+
+# Only style output for terminals, like click does. Messages to a terminal
+# stderr are also flushed right away, rather than buffered.
+_STDERR_COLOR = sys.stderr.isatty()
+_STDOUT_COLOR = sys.stdout.isatty()
+
+
+def _ansi(color: bool, err=False, **styles) -> bytes:
+    """Return the ANSI escape sequence click uses for *styles*, or nothing
+    if *color* is false.
+
+    *err* is ignored, so the secho() style dicts can be passed as is.
+    """
+    if not color:
+        return b''
+    from click import style
+    return style('', reset=False, **styles).encode()
+
+
+# Escape sequences are fixed per severity, so build them once instead of
+# styling every message with click.
+_RESET = b'\x1b[0m'
+_ERR_STYLE = {'fg': 'red', 'bold': True, 'err': True}
+_WARN_STYLE = {'fg': 'yellow', 'bold': True, 'err': True}
+_DEBUG_STYLE = {'dim': True, 'err': True}
+_VERBOSE_STYLE = {'err': True}
+_GOOD_STYLE = {'fg': 'green', 'bold': True}
+_BAD_STYLE = {'fg': 'red', 'bold': True}
+
+_ERR_PRE = _ansi(_STDERR_COLOR, **_ERR_STYLE) + b'ERROR: '
+_WARN_PRE = _ansi(_STDERR_COLOR, **_WARN_STYLE) + b'WARN: '
+_DEBUG_PRE = _ansi(_STDERR_COLOR, **_DEBUG_STYLE)
+_STDERR_POST = _RESET + b'\n' if _STDERR_COLOR else b'\n'
+_GOOD_PRE = _ansi(_STDOUT_COLOR, **_GOOD_STYLE)
+_BAD_PRE = _ansi(_STDOUT_COLOR, **_BAD_STYLE)
+_STDOUT_POST = _RESET + b'\n' if _STDOUT_COLOR else b'\n'
+
 
 def err(*args, sep=' ', **kwargs):
-    s = sep.join(str(m) for m in args)
-    kwargs.setdefault('fg', 'red')
-    kwargs.setdefault('bold', True)
-    kwargs.setdefault('err', True)
-    secho(f'ERROR: {s}', **kwargs)
+    s = _assemble(args, sep)
+    if kwargs or not _write(sys.stderr, _ERR_PRE, s, _STDERR_POST, flush=True):
+        from click import secho
+        secho(f'ERROR: {s}', **{**_ERR_STYLE, **kwargs})
 
 
 def warn(*args, sep=' ', **kwargs):
-    s = sep.join(str(m) for m in args)
-    kwargs.setdefault('fg', 'yellow')
-    kwargs.setdefault('bold', True)
-    kwargs.setdefault('err', True)
-    secho(f'WARN: {s}', **kwargs)
+    s = _assemble(args, sep)
+    if kwargs or not _write(sys.stderr, _WARN_PRE, s, _STDERR_POST, _STDERR_COLOR):
+        from click import secho
+        secho(f'WARN: {s}', **{**_WARN_STYLE, **kwargs})
 
 
 def debug(*args, sep=' ', **kwargs):
-    if __debug__:
-        s = sep.join(str(m) for m in args)
-        kwargs.setdefault('dim', True)
-        kwargs.setdefault('err', True)
-        secho(s, **kwargs)
+    if DEBUG:
+        s = _assemble(args, sep)
+        if kwargs or not _write(sys.stderr, _DEBUG_PRE, s, _STDERR_POST, _STDERR_COLOR):
+            from click import secho
+            secho(s, **{**_DEBUG_STYLE, **kwargs})
+
+
+def debug_lazy(fmt, *args, **kwargs):
+    """Like debug(), but the message is only formatted as ``fmt % args``
+    when debug output is on, like with logging.
+
+    Arguments to debug() are always evaluated, even when nothing is
+    printed. Use this for messages that are expensive to build.
+    """
+    if DEBUG:
+        debug(fmt % args if args else fmt, **kwargs)
 
 
 def verbose(*args, sep=' ', **kwargs):
     if VERBOSE or __debug__:
-        s = sep.join(str(m) for m in args)
-        kwargs.setdefault('err', True)
-        echo(s, **kwargs)
+        s = _assemble(args, sep)
+        if kwargs or not _write(sys.stderr, b'', s, b'\n', _STDERR_COLOR):
+            from click import echo
+            echo(s, **{**_VERBOSE_STYLE, **kwargs})
 
 
 def good(*args, sep=' ', **kwargs):
-    s = sep.join(str(m) for m in args)
-    kwargs.setdefault('fg', 'green')
-    kwargs.setdefault('bold', True)
-    secho(s, **kwargs)
+    s = _assemble(args, sep)
+    sys.stderr.flush()
+    if kwargs or not _write(sys.stdout, _GOOD_PRE, s, _STDOUT_POST, flush=True):
+        from click import secho
+        secho(s, **{**_GOOD_STYLE, **kwargs})
 
 
 def bad(*args, sep=' ', **kwargs):
-    s = sep.join(str(m) for m in args)
-    kwargs.setdefault('fg', 'red')
-    kwargs.setdefault('bold', True)
-    secho(s, **kwargs)
+    s = _assemble(args, sep)
+    sys.stderr.flush()
+    if kwargs or not _write(sys.stdout, _BAD_PRE, s, _STDOUT_POST, flush=True):
+        from click import secho
+        secho(s, **{**_BAD_STYLE, **kwargs})
+
+
+def _assemble(args, sep: str) -> str:
+    """Join message arguments with *sep*, like print() does."""
+    if len(args) == 1:
+        a = args[0]
+        return a if type(a) is str else str(a)
+    return sep.join(map(str, args))
+
+
+def _write(stream, pre: bytes, s: str, post: bytes, flush=False) -> bool:
+    """Write a message between pre-built *pre* and *post* byte strings to
+    the binary buffer of *stream*.
+
+    The buffer is not flushed unless *flush* is set, so bursts of messages
+    are written with a single syscall. Callers set *flush* for terminals,
+    where messages must show up right away, and for errors. Otherwise the
+    buffer is flushed when full, whenever the stream is flushed (good()
+    and bad() flush stderr before writing to stdout), and at exit.
+
+    :return: false if *stream* has no binary buffer to write to
+    """
+    buf = getattr(stream, 'buffer', None)
+    if buf is None:
+        return False
+    # One write per message, so lines from worker threads don't interleave
+    buf.write(b''.join((pre, s.encode(stream.encoding, 'backslashreplace'), post)))
+    if flush:
+        buf.flush()
+    return True
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+# Under -O debug output is off for good, so make debug calls as cheap as
+# possible instead of checking DEBUG in every call.
+if not __debug__:
+    debug = debug_lazy = _noop
 
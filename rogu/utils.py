@@ -1,9 +1,57 @@
+from functools import lru_cache
+from typing import Union
 
-def human_size(size: int) -> str:
+
+# Formatted sizes below 1K, indexed by size
+_SMALL_B = tuple(f'{i}B' for i in range(1024))
+
+_K = 1024
+_M = 1024 ** 2
+_G = 1024 ** 3
+
+# Divisor and suffix, indexed by (bit length - 1) // 10
+_UNITS = ((1, 'B'), (_K, 'K'), (_M, 'M'), (_G, 'G'))
+
+
+def human_size(size: Union[int, float]) -> str:
+    """Format a byte count as e.g. ``512B``, ``1.5K`` or ``2.0G``.
+
+    Integer sizes are formatted with integer arithmetic only, other
+    numbers are formatted with float division.
+
+    This is called once per item from loops over files. In a long hot
+    loop, bind it to a local name first (``hs = utils.human_size``) to
+    save the module attribute lookup on every call.
+    """
+    if not isinstance(size, int):
+        return _human_size_float(size)
+    # Bytes are looked up directly, so keep them out of the cache
     if size < 1024:
+        return _SMALL_B[size] if size >= 0 else f'{size}B'
+    return _human_size(size)
+
+
+def _human_size_impl(size: int) -> str:
+    # The bit length gives the unit: up to 20 bits is K, up to 30 is M,
+    # and anything larger is G.
+    unit, suffix = _UNITS[min((size.bit_length() - 1) // 10, 3)]
+    # Tenths of the unit, rounded half to even like '.1f' formatting
+    tenths, rem = divmod(size * 10, unit)
+    rem *= 2
+    if rem > unit or (rem == unit and tenths & 1):
+        tenths += 1
+    whole, frac = divmod(tenths, 10)
+    return f'{whole}.{frac}{suffix}'
+
+
+_human_size = lru_cache(maxsize=1024)(_human_size_impl)
+
+
+def _human_size_float(size: float) -> str:
+    if size < _K:
         return f'{size}B'
-    if size < 1024 ** 2:
-        return f'{size / 1024:.1f}K'
-    if size < 1024 ** 3:
-        return f'{size / 1024 ** 2:.1f}M'
-    return f'{size / 1024 ** 3:.1f}G'
+    if size < _M:
+        return f'{size / _K:.1f}K'
+    if size < _G:
+        return f'{size / _M:.1f}M'
+    return f'{size / _G:.1f}G'